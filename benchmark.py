@@ -0,0 +1,158 @@
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+import evaluate
+import evaluate_first
+
+
+class ExpressionCorpus:
+    # expressions valid for both engines: functions always take a braced argument, signs only open a brace
+    operator_mixes = {
+        'arithmetic' : {'binary' : ['+', '-', '*', '/'], 'unary' : []},
+        'trigonometric' : {'binary' : ['+', '-', '*'], 'unary' : ['sin', 'cos', 'tan', 'cot']},
+        'mixed' : {'binary' : ['+', '-', '*', '/', '%', '^'], 'unary' : ['sin', 'cos', 'tan', 'cot', 'exp', 'log']},
+    }
+
+    def __init__(self, seed=0):
+        self.random = random.Random(seed)
+
+    def operand(self):
+        return self.random.choice(['x', 'x', str(self.random.randint(1, 9)), f"{self.random.uniform(0.5, 9.5):.2f}"])
+
+    def nested_term(self, depth, mix):
+        term = self.operand()
+        for _ in range(depth):
+            operator = self.random.choice(mix['binary'])
+            if mix['unary'] and self.random.random() < 0.5:
+                term = f"{self.random.choice(mix['unary'])}({term}{operator}{self.operand()})"
+            elif self.random.random() < 0.2:
+                term = f"(-({term}){operator}{self.operand()})"
+            else:
+                term = f"({self.operand()}{operator}{term})"
+        return term
+
+    def expression(self, terms, depth, operators='mixed'):
+        mix = self.operator_mixes[operators]
+        expression = self.nested_term(depth, mix)
+        for _ in range(terms - 1):
+            expression += self.random.choice(mix['binary']) + self.nested_term(depth, mix)
+        return expression
+
+
+class EngineRunner:
+    # every engine is split into a parse and an evaluate step so they can be timed separately
+    engines = ['evaluate', 'evaluate_first', 'interpreter', 'codegen', 'batch']
+
+    def parse(self, engine, expression, at):
+        if engine == 'evaluate':
+            unit_sequence = evaluate.ExpressionUnitizer(expression).unit_sequence
+            return evaluate.UnitSequenceSolver.brace_hierarchy_sequencer(unit_sequence)
+        if engine == 'evaluate_first':
+            # ExpressionParser binds at and evaluates in __init__, its steps are replayed here
+            parser = evaluate_first.ExpressionParser.__new__(evaluate_first.ExpressionParser)
+            parser.grammar = evaluate_first.Grammar()
+            parser.expression = parser.clean_input_text(expression)
+            parser.at = at
+            parser.check_parentheses()
+            parser.unit_sequence = parser.grammar_unit_recognizer()
+            parser.block_sequence = parser.block_sequence_builder(parser.unit_sequence)
+            return parser
+        return evaluate.compile(expression, 'interpreter' if engine == 'interpreter' else 'codegen')
+
+    def evaluate(self, engine, parsed, at):
+        if engine == 'evaluate':
+            return evaluate.UnitSequenceSolver(None, at, unit_hierarchy=parsed).solution
+        if engine == 'evaluate_first':
+            return parsed.block_calculator(parsed.block_sequence).action
+        if engine == 'batch':
+            return parsed.batch(at)
+        return parsed(at)
+
+
+class BenchmarkSuite:
+    def __init__(self, engines, terms, depths, operators, at_sizes, repeat=3, seed=0):
+        self.engines = engines
+        self.terms = terms
+        self.depths = depths
+        self.operators = operators
+        self.at_sizes = at_sizes
+        self.repeat = repeat
+        self.corpus = ExpressionCorpus(seed)
+        self.runner = EngineRunner()
+
+    def at_builder(self, size):
+        if size == 1:
+            return 1.5
+        return np.linspace(0.1, 10.0, size)
+
+    def case_runner(self, engine, expression, at):
+        parse_times = list()
+        evaluate_times = list()
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            parsed = self.runner.parse(engine, expression, at)
+            parsed_at = time.perf_counter()
+            self.runner.evaluate(engine, parsed, at)
+            finished = time.perf_counter()
+            parse_times.append(parsed_at - start)
+            evaluate_times.append(finished - parsed_at)
+        # tracing slows python code down, peak memory is measured in a separate run
+        tracemalloc.start()
+        try:
+            self.runner.evaluate(engine, self.runner.parse(engine, expression, at), at)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {'parse_seconds' : min(parse_times),
+                'parse_seconds_median' : statistics.median(parse_times),
+                'evaluate_seconds' : min(evaluate_times),
+                'evaluate_seconds_median' : statistics.median(evaluate_times),
+                'peak_bytes' : peak}
+
+    def __call__(self):
+        results = list()
+        for operators in self.operators:
+            for terms in self.terms:
+                for depth in self.depths:
+                    expression = self.corpus.expression(terms, depth, operators)
+                    for at_size in self.at_sizes:
+                        at = self.at_builder(at_size)
+                        for engine in self.engines:
+                            record = {'engine' : engine, 'operators' : operators, 'terms' : terms, 'depth' : depth,
+                                      'length' : len(expression), 'at_size' : at_size}
+                            try:
+                                with np.errstate(all='ignore'):
+                                    record.update(self.case_runner(engine, expression, at))
+                            except Exception as e:
+                                record['error'] = f"{type(e).__name__}: {e.args[-1] if e.args else ''}"
+                            results.append(record)
+                            print(json.dumps(record), file=sys.stderr)
+        return results
+
+
+def integer_list(text):
+    return [int(float(value)) for value in text.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time parsing and evaluation of the expression engines over a generated corpus.')
+    parser.add_argument('--engines', type=lambda text: text.split(','), default=EngineRunner.engines)
+    parser.add_argument('--terms', type=integer_list, default=[1, 10, 100])
+    parser.add_argument('--depths', type=integer_list, default=[1, 5, 25])
+    parser.add_argument('--operators', type=lambda text: text.split(','), default=list(ExpressionCorpus.operator_mixes))
+    parser.add_argument('--at-sizes', type=integer_list, default=[1, 1000, 1000000], help='Comma separated, e.g. 1,1e3,1e7.')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default='benchmark_results.json')
+    inputs = parser.parse_args()
+
+    suite = BenchmarkSuite(inputs.engines, inputs.terms, inputs.depths, inputs.operators, inputs.at_sizes, inputs.repeat, inputs.seed)
+    results = suite()
+    with open(inputs.output, 'w') as output:
+        json.dump({'python' : sys.version, 'numpy' : np.__version__, 'results' : results}, output, indent=1)
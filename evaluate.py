@@ -1,7 +1,42 @@
+from __future__ import annotations
 import argparse
+import bisect
+import builtins
+from array import array
+import functools
+import importlib
+import importlib.util
+import marshal
+import mmap
+import os
+import struct
+import sys
+import time
+import types
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
 from typing import List, Union
-import numpy as np
 import re
+import threading
+from collections import OrderedDict
+from itertools import accumulate
+
+
+class LazyModule:
+    # imported on first attribute access, the attributes are then cached on the instance
+    def __init__(self, module_name):
+        self.module_name = module_name
+
+    def __getattr__(self, attribute):
+        value = getattr(importlib.import_module(self.module_name), attribute)
+        setattr(self, attribute, value)
+        return value
+
+
+# parsing, compiling and loading stored expressions do not need these, evaluation imports them
+np = LazyModule('numpy')
+asyncio = LazyModule('asyncio')
 
 class CliInputTransformer:
 
@@ -11,7 +46,13 @@ class CliInputTransformer:
     def get_raw_input(self):
         parser = argparse.ArgumentParser(description='Calculate the output of a mathematical expression string and a number (or list of numbers).')
         parser.add_argument('--expression', type=str, required=True)
-        parser.add_argument('--numbers', type=str, required=True) # str instead float because of comma separated values
+        source = parser.add_mutually_exclusive_group(required=True)
+        source.add_argument('--numbers', type=str) # str instead float because of comma separated values
+        source.add_argument('--input', type=str, help="File of x values streamed in chunks, '-' for stdin.")
+        parser.add_argument('--input-format', choices=['text', 'binary'], default='text', help='Separated numbers or raw float64, binary files are memory-mapped.')
+        parser.add_argument('--output', type=str, default='-', help="File of results, '-' for stdout.")
+        parser.add_argument('--output-format', choices=['text', 'binary'], default='text')
+        parser.add_argument('--chunk-size', type=int, default=1 << 16)
         inputs = parser.parse_args()
         return inputs
 
@@ -25,32 +66,123 @@ class ExpressionError(Exception):
     pass
 
 
+class Instrumentation:
+    # opt-in stage timings and counters, disabled call sites only test the enabled flag.
+    # per-evaluation stages time themselves inline, timed adds a call frame even when disabled.
+    # compiled expressions record 'node_array' and an 'action <unit>' per operator node, evaluated by their node
+    # array while enabled. operator_collapser levels are only timed by UnitSequenceSolver and IncrementalSolver,
+    # batch and parallel evaluation only as a whole 'chunked_solver' stage
+    def __init__(self):
+        self.enabled = False
+        self.callback = None
+        self.lock = threading.Lock()
+        self.active = threading.local()
+        self.stages = dict()
+        self.counters = dict()
+
+    def enable(self, callback=None):
+        # callback(stage, seconds) is called for every timed stage
+        self.callback = callback
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.callback = None
+
+    def reset(self):
+        with self.lock:
+            self.stages = dict()
+            self.counters = dict()
+
+    def record(self, stage, seconds):
+        with self.lock:
+            calls, total = self.stages.get(stage, (0, 0.0))
+            self.stages[stage] = (calls + 1, total + seconds)
+        callback = self.callback
+        if callback is not None:
+            callback(stage, seconds)
+
+    def count(self, counter):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            stages = {stage : {'calls' : calls, 'seconds' : total, 'mean_seconds' : total / calls}
+                      for stage, (calls, total) in self.stages.items()}
+            return {'stages' : stages, 'counters' : dict(self.counters)}
+
+    def timed(self, stage):
+        # recursive calls of a stage are timed once, by the outermost call
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled or stage in getattr(self.active, 'stages', ()):
+                    return function(*args, **kwargs)
+                if not hasattr(self.active, 'stages'):
+                    self.active.stages = set()
+                self.active.stages.add(stage)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+                    self.active.stages.discard(stage)
+            return wrapper
+        return decorator
+
+
+instrumentation = Instrumentation()
+
+
 class Grammar():
     units = {
-        '*' : { 'action' : lambda left, right : np.multiply(left,right),
-                'unit_type' : 'binary'},
-        '/' : {'action' : lambda left, right : np.divide(left,right),
-                'unit_type' : 'binary'},
-        '%' : {'action' : lambda left, right : np.mod(left,right),
-                'unit_type' : 'binary'},
-        '^' : {'action' : lambda left, right : np.power(left,right),
-                'unit_type' : 'binary'},
-        '+' : {'action' : lambda left=0, right=0 : np.add(left,right),
-                'unit_type' : 'ambiguous'},
-        '-' : {'action' : lambda left=0, right=0 : np.subtract(left,right),
-                'unit_type' : 'ambiguous'},
-        'sin' : {'action' : lambda right : np.sin(right),
-                'unit_type' : 'unary'},
-        'cos' : {'action' : lambda right : np.cos(right),
-                'unit_type' : 'unary'},
-        'tan' : {'action' : lambda right : np.sin(right)/np.cos(right),
-                'unit_type' : 'unary'},
-        'cot' : {'action' : lambda right : np.cos(right)/np.sin(right),
-                'unit_type' : 'unary'},
-        'exp' : {'action' : lambda right : np.exp(right),
-                'unit_type' : 'unary'},
-        'log' : {'action' : lambda right : np.log(right),
-                'unit_type' : 'unary'},
+        '*' : { 'action' : lambda left, right, out=None : np.multiply(left,right,out=out),
+                'scalar_action' : lambda left, right : left * right,
+                'unit_type' : 'binary',
+                'source' : 'np.multiply({left}, {right})',
+                'scalar_source' : '{left} * {right}'},
+        '/' : {'action' : lambda left, right, out=None : np.divide(left,right,out=out),
+                'scalar_action' : lambda left, right : left / right,
+                'unit_type' : 'binary',
+                'source' : 'np.divide({left}, {right})',
+                'scalar_source' : '{left} / {right}'},
+        '%' : {'action' : lambda left, right, out=None : np.mod(left,right,out=out),
+                'scalar_action' : lambda left, right : left % right,
+                'unit_type' : 'binary',
+                'source' : 'np.mod({left}, {right})',
+                'scalar_source' : '{left} % {right}'},
+        '^' : {'action' : lambda left, right, out=None : np.power(left,right,out=out),
+                'unit_type' : 'binary',
+                'source' : 'np.power({left}, {right})'},
+        '+' : {'action' : lambda left=0, right=0, out=None : np.add(left,right,out=out),
+                'scalar_action' : lambda left=0, right=0 : left + right,
+                'unit_type' : 'ambiguous',
+                'source' : 'np.add({left}, {right})',
+                'scalar_source' : '{left} + {right}'},
+        '-' : {'action' : lambda left=0, right=0, out=None : np.subtract(left,right,out=out),
+                'scalar_action' : lambda left=0, right=0 : left - right,
+                'unit_type' : 'ambiguous',
+                'source' : 'np.subtract({left}, {right})',
+                'scalar_source' : '{left} - {right}'},
+        'sin' : {'action' : lambda right, out=None : np.sin(right,out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.sin({right})'},
+        'cos' : {'action' : lambda right, out=None : np.cos(right,out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.cos({right})'},
+        'tan' : {'action' : lambda right, out=None : np.divide(np.sin(right),np.cos(right,out=out),out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.sin({right})/np.cos({right})'},
+        'cot' : {'action' : lambda right, out=None : np.divide(np.cos(right),np.sin(right,out=out),out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.cos({right})/np.sin({right})'},
+        'exp' : {'action' : lambda right, out=None : np.exp(right,out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.exp({right})'},
+        'log' : {'action' : lambda right, out=None : np.log(right,out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.log({right})'},
         'x' : {'action' : lambda a : a,
                 'unit_type' : 'placeholder'},
         '(' : {'action' : None,
@@ -59,6 +191,12 @@ class Grammar():
                 'unit_type' : 'right_brace'}       
     }
     
+    # actions accept an out buffer which may be one of their operands, tan and cot read their operand before writing it
+    # scalar actions and sources are used for a float at, only where python floats give numpy's result bit for bit,
+    # math's exp, log, pow and tan differ from numpy in the last bit so the other units keep their numpy version.
+    # division or mod by zero raises ZeroDivisionError for python floats, the scalar path then falls back to numpy
+    # and returns inf or nan with a RuntimeWarning like arrays do. overflow and inf - inf give inf and nan as in
+    # numpy but without the RuntimeWarning
     operator_precedence = ['sign','unary','binary','addsub']
 
     operator_domain = { 'sign' : 'right',
@@ -66,9 +204,27 @@ class Grammar():
                         'binary' : 'leftright',
                         'addsub' : 'leftright'}
 
+    # only produced by NodeSequenceOptimizer, never recognized in expressions
+    fused_units = {
+        'tan_fused' : {'action' : lambda right, out=None : np.tan(right,out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.tan({right})'},
+        'cot_fused' : {'action' : lambda right, out=None : np.divide(1.0,np.tan(right,out=out),out=out),
+                'unit_type' : 'unary',
+                'source' : 'np.divide(1.0, np.tan({right}))'},
+    }
+
+    @classmethod
+    def unit_spec(cls, unit):
+        return cls.units[unit] if unit in cls.units else cls.fused_units[unit]
+
 
 class GrammarUnit:
+    __slots__ = ('string_unit', 'start_index', 'unit_type', 'action')
+
     def __init__(self, unit, start_index, prior_unit_type=None):
+        if instrumentation.enabled:
+            instrumentation.count('GrammarUnit')
         if isinstance(unit, str):
             self.operator_setup(unit, start_index, prior_unit_type)
         else:
@@ -77,11 +233,11 @@ class GrammarUnit:
     def operator_setup(self, operator, i, prior_unit_type):
         self.string_unit = operator 
         self.start_index = i 
-        self.unit_type = Grammar.units[operator]['unit_type'] 
-        self.action = Grammar.units[operator]['action']
+        self.unit_type = Grammar.unit_spec(operator)['unit_type']
+        self.action = Grammar.unit_spec(operator)['action']
         if (operator in ['+', '-'] and 
             (
-                i==0 or
+                i==0 or prior_unit_type is None or
                 ((i>0) and (prior_unit_type in ['binary', 'left_brace'])))
             ):
             self.unit_type = 'sign' 
@@ -89,19 +245,26 @@ class GrammarUnit:
             self.unit_type = 'addsub'
 
     def number_setup(self, number, i):
-        self.string_unit = str(number) 
+        # numbers and intermediate results are only used by value, formatting whole arrays is not worth it
+        self.string_unit = None
         self.start_index = i 
         self.unit_type = 'number' 
         self.action = number       
 
 
 class ExpressionUnitizer:
+    longest_first = sorted(Grammar.units.keys(), key=len, reverse=True)
+    # one alternation for every unit, numbers first, operators longest first
+    # whitespace separates units, it is matched after each unit so '1 2' stays two numbers
+    unit_pattern = re.compile(r'(?:(\d+(?:\.\d+)?)|({}))\s*'.format('|'.join(map(re.escape, longest_first))))
+    space_pattern = re.compile(r'\s*')
+
     def __init__(self,expression):
         self.expression=expression
-        self.longest_first = sorted(Grammar.units.keys(), key=len, reverse=True)
         self.check_parentheses()
         self.unit_sequence = self.unit_sequencer()
 
+    @instrumentation.timed('check_parentheses')
     def check_parentheses(self):
         parentheses_counter = [0,0]
         for i, c in enumerate(self.expression):
@@ -112,44 +275,40 @@ class ExpressionUnitizer:
         if parentheses_counter[0] != parentheses_counter[1]:
                 raise ExpressionError(self.expression, "Number of left and right parentheses are different. Too many left parentheses. ") 
 
-    def operator_recognizer(self, sequence, operators):
-        result = re.search(r'^(?:{})'.format('|'.join(map(re.escape, operators))), sequence)
-        operator = result.group(0) if result else None
-        return operator
-
-    def number_recognizer(self, sequence):
-        result =  re.search(r'^(\d+(\.\d+)?)', sequence)
-        number = result.group(0) if result else None
-        return number
-
+    @instrumentation.timed('unit_sequencer')
     def unit_sequencer(self):
         unit_sequence = list()
-        i=0
-        while i < len(self.expression):
-            step=1
-            found_operator = self.operator_recognizer(self.expression[i:], self.longest_first)
-            found_number = self.number_recognizer(self.expression[i:])
-            if found_operator:
-                step=len(found_operator)
-                prior_type = unit_sequence[-1].unit_type if i>0 else None
-                unit_sequence.append(GrammarUnit(found_operator, i, prior_type))
-            elif found_number:
-                step=len(found_number)
-                unit_sequence.append(GrammarUnit(float(found_number), i))
-            else:
-                raise ExpressionError(self.expression, f"Invalid character at index {i}.")
-            i+=step  
+        expression = self.expression
+        prior_type = None
+        i = self.space_pattern.match(expression).end()
+        while i < len(expression):
+            unit, i = self.unit_matcher(expression, i, prior_type)
+            unit_sequence.append(unit)
+            prior_type = unit.unit_type
         return unit_sequence    
 
+    @classmethod
+    def unit_matcher(cls, expression, i, prior_type):
+        # a unit only depends on the text from i on and the type of the unit before it
+        found = cls.unit_pattern.match(expression, i)
+        if found is None:
+            raise ExpressionError(expression, f"Invalid character at index {i}.")
+        found_number, found_operator = found.groups()
+        if found_operator:
+            return GrammarUnit(found_operator, i, prior_type), found.end()
+        return GrammarUnit(float(found_number), i), found.end()
+
 
 class UnitSequenceSolver:
-    def __init__(self, unit_sequence, at):
+    def __init__(self, unit_sequence, at, unit_hierarchy=None):
         self.at = at
-        self.unit_hierarchy = self.brace_hierarchy_sequencer(unit_sequence)
+        self.unit_hierarchy = unit_hierarchy if unit_hierarchy is not None else self.brace_hierarchy_sequencer(unit_sequence)
         self.reduced = self.hierarchy_calculator(self.unit_hierarchy) 
         self.solution = self.reduced.action  
 
-    def brace_hierarchy_sequencer(self, sequence):
+    @classmethod
+    @instrumentation.timed('brace_hierarchy_sequencer')
+    def brace_hierarchy_sequencer(cls, sequence):
         unit_hierarchy = list()
         i = 0
         while i < len(sequence):
@@ -163,19 +322,22 @@ class UnitSequenceSolver:
                     if sequence[i+j].unit_type == 'left_brace': brace_count += 1
                     if sequence[i+j].unit_type == 'right_brace': brace_count -= 1
                     j+=1             
-                sub_block = self.brace_hierarchy_sequencer(list(sequence[i+1:i+j-1]))
+                sub_block = cls.brace_hierarchy_sequencer(list(sequence[i+1:i+j-1]))
                 unit_hierarchy.append(sub_block)
                 i+=j   
             elif sequence[i].unit_type == 'right_brace':
-                raise ExpressionError(self.expression, f"Invalid rihght brace at {sequence[i].start_index}.") 
+                raise ExpressionError(f"Invalid right brace at {sequence[i].start_index}.")
         return unit_hierarchy
 
 
     def operator_collapser(self, sequence):
+        timing = instrumentation.enabled
         for operator_type in Grammar.operator_precedence:
             domain_positions = Grammar.operator_domain[operator_type]
+            if timing: level_start = time.perf_counter()
             for i, entity in enumerate(sequence):
                 if entity.unit_type == operator_type: 
+                    if timing: action_start = time.perf_counter()
                     try:
                         if domain_positions == 'leftright':
                             result = entity.action(left=sequence[i-1].action, right=sequence[i+1].action)
@@ -188,15 +350,18 @@ class UnitSequenceSolver:
                     except TypeError as e:
                         print('Error: ', e)
                         raise ExpressionError(f'Invalid syntax at index {entity.start_index}.')     
+                    if timing: instrumentation.record(f"action {entity.string_unit}", time.perf_counter() - action_start)
             sequence = list(filter(lambda x: x is not None, sequence))
+            if timing: instrumentation.record(f"operator_collapser {operator_type}", time.perf_counter() - level_start)
         return sequence 
 
     def hierarchy_calculator(self, sequence):
-        sequence[:] = [self.hierarchy_calculator(entity) if isinstance(entity, list) else entity for entity in sequence]
+        # builds new lists and units, the hierarchy itself can be shared by compiled expressions
+        sequence = [self.hierarchy_calculator(entity) if isinstance(entity, (list, tuple)) else entity for entity in sequence]
 
-        for entity in sequence:
+        for i, entity in enumerate(sequence):
             if entity.unit_type == 'placeholder':
-                entity.action = entity.action(self.at)
+                sequence[i] = GrammarUnit(unit=entity.action(self.at), start_index=entity.start_index)
 
         reduced_sequence = self.operator_collapser(sequence)
 
@@ -206,14 +371,1527 @@ class UnitSequenceSolver:
         return reduced_sequence[0]
 
 
+class IncrementalBlock:
+    # a brace block of IncrementalSolver, the root block is the whole expression and has no braces.
+    # items are its units and sub-blocks in text order, lengths their text lengths with the whitespace after them,
+    # lead and tail the lengths of the left and right brace with their whitespace
+    __slots__ = ('items', 'lengths', 'lead', 'tail', 'size', 'value', 'depends_on_x')
+
+    def __init__(self, items, lengths, lead, tail):
+        self.items = items
+        self.lengths = lengths
+        self.lead = lead
+        self.tail = tail
+        self.size = lead + sum(lengths) + tail
+        self.value = None
+        self.depends_on_x = False
+
+
+class IncrementalSolver(UnitSequenceSolver):
+    # re-solves an edited expression for a fixed at. the expression is kept as a tree of brace blocks, an edit
+    # is tokenized again in the innermost block holding it, from the unit before the edit until an unchanged item
+    # of the old text is met, every other block is reused by identity. that block and the blocks around it are
+    # collapsed again, so an edit in a long top level still collapses the whole top level.
+    # at is compared by identity: an array changed in place keeps the x-dependent values of its old contents,
+    # pass a new array after changing it
+    def __init__(self, at):
+        self.at = at
+        self.expression = None
+        self.root = None
+        self.scanned = 0
+        self.solved = 0
+
+    def __call__(self, expression, at=None):
+        self.scanned = 0
+        self.solved = 0
+        if at is not None and at is not self.at:
+            # a new at object keeps only the x-independent blocks
+            self.at = at
+            if self.root is not None:
+                try:
+                    self.x_resolver(self.root)
+                except Exception:
+                    self.expression = None
+                    self.root = None
+        try:
+            if self.root is None:
+                root = self.block_builder(expression)
+            elif expression != self.expression:
+                root = self.block_updater(expression)
+            else:
+                root = self.root
+        except Exception:
+            # errors are reported the way the full solver reports them, the last valid expression stays the
+            # base of the next edit, blocks are replaced and not changed by an update
+            return UnitSequenceSolver(ExpressionUnitizer(expression).unit_sequence, self.at).solution
+        self.expression = expression
+        self.root = root
+        return root.value.action
+
+    def common_length(self, same, limit):
+        # the longest n <= limit with same(0, n). the matched length grows in doubling steps and the last step
+        # is bisected, so only the matched text and one step are compared
+        low, step = 0, 64
+        while low < limit:
+            high = min(low + step, limit)
+            if not same(low, high):
+                break
+            low, step = high, 2 * step
+        else:
+            return low
+        high -= 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if same(low, middle):
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def common_affixes(self, a, b):
+        limit = min(len(a), len(b))
+        prefix = self.common_length(lambda start, stop : a[start:stop] == b[start:stop], limit)
+        suffix = self.common_length(lambda start, stop : a[len(a) - stop:len(a) - start] == b[len(b) - stop:len(b) - start],
+                                    limit - prefix)
+        return prefix, suffix
+
+    def item_type(self, item):
+        return 'right_brace' if isinstance(item, IncrementalBlock) else item.unit_type
+
+    def block_builder(self, expression):
+        lead = ExpressionUnitizer.space_pattern.match(expression).end()
+        items, lengths, _ = self.item_scanner(expression, lead, len(expression), None)
+        root = IncrementalBlock(items, lengths, lead, 0)
+        self.block_solver(root)
+        return root
+
+    def block_updater(self, expression):
+        old_expression = self.expression
+        prefix, suffix = self.common_affixes(old_expression, expression)
+        shift = len(expression) - len(old_expression)
+        stop = len(old_expression) - suffix # the edit replaced old_expression[prefix:stop]
+        if prefix < self.root.lead:
+            return self.block_builder(expression)
+        path = list()
+        block, start = self.root, 0
+        while True:
+            offsets = list(accumulate(block.lengths, initial=start + block.lead))
+            # the item holding the character before the edit, a number there may continue into the edit
+            first = bisect.bisect_right(offsets, prefix - 1) - 1 if prefix > offsets[0] else 0
+            item = block.items[first]
+            if not (isinstance(item, IncrementalBlock) and
+                    offsets[first] + item.lead <= prefix and stop <= offsets[first + 1] - item.tail):
+                break
+            path.append((block, first))
+            block, start = item, offsets[first]
+        start_prior = 'left_brace' if path else None
+        prior_type = self.item_type(block.items[first - 1]) if first > 0 else start_prior
+        items, lengths, last = self.item_scanner(expression, offsets[first], offsets[-1] + shift, prior_type,
+                                                 (block, offsets, shift, stop + shift, start_prior))
+        block = IncrementalBlock(block.items[:first] + items + block.items[last:],
+                                 block.lengths[:first] + lengths + block.lengths[last:], block.lead, block.tail)
+        self.block_solver(block)
+        while path:
+            parent, index = path.pop()
+            items, lengths = list(parent.items), list(parent.lengths)
+            items[index] = block
+            lengths[index] += shift
+            block = IncrementalBlock(items, lengths, parent.lead, parent.tail)
+            self.block_solver(block)
+        return block
+
+    def item_scanner(self, expression, i, end, prior_type, old=None):
+        # units and new sub-blocks from i to end, sub-blocks are solved when their right brace is read.
+        # old is (block, offsets, shift, resync_from, start_prior), from resync_from on the scan stops at an item of
+        # the old block starting at the same text after the same unit type, the index of that item is returned
+        items, lengths = list(), list()
+        open_blocks = list()
+        if old is not None:
+            old_block, offsets, shift, resync_from, start_prior = old
+        while i < end:
+            if old is not None and not open_blocks and i >= resync_from:
+                j = bisect.bisect_left(offsets, i - shift)
+                if (j < len(old_block.items) and offsets[j] == i - shift and
+                        (self.item_type(old_block.items[j - 1]) if j > 0 else start_prior) == prior_type):
+                    return items, lengths, j
+            unit, following = ExpressionUnitizer.unit_matcher(expression, i, prior_type)
+            self.scanned += 1
+            if unit.unit_type == 'left_brace':
+                open_blocks.append((items, lengths, i, following - i))
+                items, lengths = list(), list()
+            elif unit.unit_type == 'right_brace':
+                if not open_blocks:
+                    raise ExpressionError(expression, f"Invalid right brace at {i}.")
+                outer_items, outer_lengths, block_start, lead = open_blocks.pop()
+                block = IncrementalBlock(items, lengths, lead, following - i)
+                self.block_solver(block)
+                items, lengths = outer_items, outer_lengths
+                items.append(block)
+                lengths.append(following - block_start)
+            else:
+                items.append(unit)
+                lengths.append(following - i)
+            prior_type = unit.unit_type
+            i = following
+        if open_blocks:
+            raise ExpressionError(expression, f"Missing right brace for index {open_blocks[-1][2]}.")
+        if i != end:
+            raise ExpressionError(expression, f"Invalid syntax at index {end}.")
+        return items, lengths, len(old_block.items) if old is not None else 0
+
+    def block_solver(self, block):
+        sequence = list()
+        depends_on_x = False
+        for item in block.items:
+            if isinstance(item, IncrementalBlock):
+                sequence.append(item.value)
+                depends_on_x = depends_on_x or item.depends_on_x
+            elif item.unit_type == 'placeholder':
+                sequence.append(GrammarUnit(unit=item.action(self.at), start_index=item.start_index))
+                depends_on_x = True
+            else:
+                sequence.append(item)
+        self.solved += 1
+        reduced_sequence = self.operator_collapser(sequence)
+        if len(reduced_sequence) != 1:
+            raise Exception('Something wrong, final output has too many elements.')
+        block.value = reduced_sequence[0]
+        block.depends_on_x = depends_on_x
+
+    def x_resolver(self, root):
+        # blocks depending on x are solved again after their sub-blocks, without recursion
+        stack = [(root, False)]
+        while stack:
+            block, ready = stack.pop()
+            if ready:
+                self.block_solver(block)
+                continue
+            stack.append((block, True))
+            stack.extend((item, False) for item in block.items if isinstance(item, IncrementalBlock) and item.depends_on_x)
+
+
+class ExpressionNode:
+    __slots__ = ('unit', 'operands', 'released')
+
+    def __init__(self, unit, operands=()):
+        self.unit = unit
+        self.operands = operands # indices of earlier nodes
+        self.released = () # operand values which are not needed after this node
+
+
+class UnitSequenceParser:
+    # shunting-yard over the unit sequence, emits the nodes in evaluation order without recursion
+    precedence = {operator_type : level for level, operator_type in enumerate(Grammar.operator_precedence)}
+
+    def __init__(self, unit_sequence, expression=None):
+        self.expression = expression
+        self.nodes = self.node_sequencer(unit_sequence)
+        self.release_marker(self.nodes)
+
+    def syntax_error(self, unit):
+        return ExpressionError(self.expression, f"Invalid syntax at index {unit.start_index}.")
+
+    @instrumentation.timed('node_sequencer')
+    def node_sequencer(self, sequence):
+        nodes = list()
+        operands = list() # indices of the nodes not consumed yet
+        operators = list()
+        expect_operand = True
+        for unit in sequence:
+            if expect_operand:
+                if unit.unit_type in ['number', 'placeholder']:
+                    nodes.append(ExpressionNode(unit))
+                    operands.append(len(nodes) - 1)
+                    self.prefix_reducer(nodes, operands, operators)
+                    expect_operand = False
+                elif unit.unit_type in ['sign', 'unary']:
+                    # a prefix operator takes exactly one operand, chaining them is invalid
+                    if operators and operators[-1].unit_type in ['sign', 'unary']:
+                        raise self.syntax_error(unit)
+                    operators.append(unit)
+                elif unit.unit_type == 'left_brace':
+                    operators.append(unit)
+                else:
+                    raise self.syntax_error(unit)
+            else:
+                if unit.unit_type in ['binary', 'addsub']:
+                    while (operators and operators[-1].unit_type != 'left_brace' and
+                           self.precedence[operators[-1].unit_type] <= self.precedence[unit.unit_type]):
+                        self.operator_reducer(nodes, operands, operators.pop())
+                    operators.append(unit)
+                    expect_operand = True
+                elif unit.unit_type == 'right_brace':
+                    while operators and operators[-1].unit_type != 'left_brace':
+                        self.operator_reducer(nodes, operands, operators.pop())
+                    if not operators:
+                        raise ExpressionError(self.expression, f"Invalid right brace at {unit.start_index}.")
+                    operators.pop()
+                    self.prefix_reducer(nodes, operands, operators)
+                else:
+                    raise self.syntax_error(unit)
+        if expect_operand:
+            raise ExpressionError(self.expression, "Expression ends without an operand.")
+        while operators:
+            if operators[-1].unit_type == 'left_brace':
+                raise ExpressionError(self.expression, f"Missing right brace for index {operators[-1].start_index}.")
+            self.operator_reducer(nodes, operands, operators.pop())
+        return nodes
+
+    def prefix_reducer(self, nodes, operands, operators):
+        if operators and operators[-1].unit_type in ['sign', 'unary']:
+            self.operator_reducer(nodes, operands, operators.pop())
+
+    def operator_reducer(self, nodes, operands, operator):
+        right = operands.pop()
+        if Grammar.operator_domain[operator.unit_type] == 'leftright':
+            left = operands.pop()
+            nodes.append(ExpressionNode(operator, (left, right)))
+        else:
+            nodes.append(ExpressionNode(operator, (right,)))
+        operands.append(len(nodes) - 1)
+
+    @staticmethod
+    def release_marker(nodes):
+        last_use = dict()
+        for i, node in enumerate(nodes):
+            for operand in node.operands:
+                last_use[operand] = i
+        released = [list() for _ in nodes]
+        for operand, i in last_use.items():
+            released[i].append(operand)
+        for node, node_released in zip(nodes, released):
+            node.released = tuple(node_released)
+
+
+class NodeSequenceSolver:
+    def __init__(self, nodes, at, roots=None):
+        self.at = at
+        if roots is None:
+            self.solution = self.node_calculator(nodes, {len(nodes) - 1})[len(nodes) - 1]
+        else:
+            root_values = self.node_calculator(nodes, set(roots))
+            self.solution = [root_values[root] for root in roots]
+
+    def node_calculator(self, nodes, roots):
+        # root values are kept aside, a root of one expression can be an operand released by another
+        root_values = dict()
+        values = [None] * len(nodes)
+        timing = instrumentation.enabled
+        if timing: start = time.perf_counter()
+        for i, node in enumerate(nodes):
+            unit = node.unit
+            if unit.unit_type == 'number':
+                values[i] = unit.action
+            elif unit.unit_type == 'placeholder':
+                values[i] = unit.action(self.at)
+            else:
+                if timing: action_start = time.perf_counter()
+                if Grammar.operator_domain[unit.unit_type] == 'leftright':
+                    values[i] = unit.action(left=values[node.operands[0]], right=values[node.operands[1]])
+                else:
+                    values[i] = unit.action(right=values[node.operands[0]])
+                if timing: instrumentation.record(f"action {unit.string_unit}", time.perf_counter() - action_start)
+            if i in roots:
+                root_values[i] = values[i]
+            for operand in node.released:
+                values[operand] = None
+        if timing: instrumentation.record('node_calculator', time.perf_counter() - start)
+        return root_values
+
+
+class NodeArray:
+    # a node sequence as parallel arrays of unit codes, operand indices and start indices plus a constant pool
+    __slots__ = ('codes', 'operands', 'start_indices', 'last_uses', 'constants')
+
+    unit_keys = ([(None, 'number')] +
+                 [(unit, spec['unit_type']) for unit, spec in list(Grammar.units.items()) + list(Grammar.fused_units.items())
+                  if spec['unit_type'] in ['placeholder', 'unary', 'binary']] +
+                 [(unit, unit_type) for unit in ['+', '-'] for unit_type in ['sign', 'addsub']])
+    unit_codes = {key : code for code, key in enumerate(unit_keys)}
+    unit_domains = [unit_type if unit_type in ['number', 'placeholder'] else Grammar.operator_domain[unit_type]
+                    for unit, unit_type in unit_keys]
+    unit_actions = [None if unit is None else Grammar.unit_spec(unit)['action'] for unit, unit_type in unit_keys]
+    unit_scalar_actions = [None if unit is None else Grammar.unit_spec(unit).get('scalar_action', Grammar.unit_spec(unit)['action'])
+                           for unit, unit_type in unit_keys]
+
+    def __init__(self, nodes):
+        self.codes = array('B')
+        self.operands = array('i') # two per node, -1 when unused, numbers hold their constant pool index
+        self.start_indices = array('i')
+        self.last_uses = array('i', [-1]) * len(nodes)
+        self.constants = list()
+        pool = dict()
+        for i, node in enumerate(nodes):
+            unit = node.unit
+            if unit.unit_type == 'number':
+                key = float(unit.action).hex()
+                if key not in pool:
+                    pool[key] = len(self.constants)
+                    self.constants.append(unit.action)
+                self.codes.append(0)
+                self.operands.extend((pool[key], -1))
+            else:
+                self.codes.append(self.unit_codes[(unit.string_unit, unit.unit_type)])
+                self.operands.extend(tuple(node.operands) + (-1,) * (2 - len(node.operands)))
+            self.start_indices.append(unit.start_index)
+            for operand in node.operands:
+                self.last_uses[operand] = i
+
+    def __len__(self):
+        return len(self.codes)
+
+    def node_operands(self, i):
+        if self.codes[i] == 0:
+            return ()
+        return tuple(operand for operand in self.operands[2 * i:2 * i + 2] if operand >= 0)
+
+    def node_sequence(self):
+        nodes = list()
+        for i, code in enumerate(self.codes):
+            unit, unit_type = self.unit_keys[code]
+            if unit_type == 'number':
+                grammar_unit = GrammarUnit(self.constants[self.operands[2 * i]], self.start_indices[i])
+            else:
+                grammar_unit = GrammarUnit(unit, self.start_indices[i])
+                grammar_unit.unit_type = unit_type
+            nodes.append(ExpressionNode(grammar_unit, self.node_operands(i)))
+        UnitSequenceParser.release_marker(nodes)
+        return tuple(nodes)
+
+    def fingerprint(self):
+        # equal for equal node arrays, constants are compared by their bits so nan constants match too
+        return self.codes.tobytes() + self.operands.tobytes() + array('d', self.constants).tobytes()
+
+    def node_table(self):
+        return tuple((self.constants[self.operands[2 * i]] if code == 0 else self.unit_keys[code][0],
+                      self.start_indices[i], self.unit_keys[code][1], self.node_operands(i)) for i, code in enumerate(self.codes))
+
+    def __call__(self, at, actions=None):
+        actions = actions or self.unit_actions
+        values = [None] * len(self.codes)
+        operands = self.operands
+        last_uses = self.last_uses
+        timing = instrumentation.enabled
+        if timing: start = time.perf_counter()
+        for i, code in enumerate(self.codes):
+            domain = self.unit_domains[code]
+            left, right = operands[2 * i], operands[2 * i + 1]
+            if domain == 'number':
+                values[i] = self.constants[left]
+                continue
+            if domain == 'placeholder':
+                values[i] = at
+                continue
+            if timing: action_start = time.perf_counter()
+            if domain == 'leftright':
+                values[i] = actions[code](left=values[left], right=values[right])
+                if last_uses[right] == i:
+                    values[right] = None
+            else:
+                values[i] = actions[code](right=values[left])
+            if last_uses[left] == i:
+                values[left] = None
+            if timing: instrumentation.record(f"action {self.unit_keys[code][0]}", time.perf_counter() - action_start)
+        if timing: instrumentation.record('node_array', time.perf_counter() - start)
+        return values[-1]
+
+
+class NodeSequenceOptimizer:
+    # folds subtrees without the placeholder, drops identities and strength-reduces, one pass in node order
+    # adding zero is left out, -0.0 + 0 is +0.0 in numpy. signs are subtractions from zero,
+    # so dropping a double sign turns a -0.0 operand into -0.0 where numpy gives +0.0
+    identities = {('*', 'left') : 1.0, ('*', 'right') : 1.0,
+                  ('-', 'right') : 0.0,
+                  ('/', 'right') : 1.0,
+                  ('^', 'right') : 1.0}
+
+    fused = {'tan' : 'tan_fused', 'cot' : 'cot_fused'}
+
+    def __init__(self, nodes):
+        self.rewrites = list()
+        self.nodes = self.dead_node_remover(self.node_rewriter(nodes))
+        UnitSequenceParser.release_marker(self.nodes)
+
+    def number_value(self, node):
+        return node.unit.action if node.unit.unit_type == 'number' else None
+
+    @instrumentation.timed('node_rewriter')
+    def node_rewriter(self, nodes):
+        new_nodes = list()
+        positions = [None] * len(nodes)
+        for i, node in enumerate(nodes):
+            operands = tuple(positions[operand] for operand in node.operands)
+            positions[i] = self.node_optimizer(node.unit, operands, new_nodes)
+        if nodes[-1].operands and new_nodes[positions[-1]].unit.unit_type == 'placeholder':
+            # the root operation is kept, otherwise the caller would get their own at back
+            self.rewrites.pop()
+            new_nodes.append(ExpressionNode(nodes[-1].unit, tuple(positions[operand] for operand in nodes[-1].operands)))
+            positions[-1] = len(new_nodes) - 1
+        # the root is moved to the end by dead_node_remover
+        new_nodes.append(ExpressionNode(None, (positions[-1],)))
+        return new_nodes
+
+    def node_optimizer(self, unit, operands, nodes):
+        if not operands:
+            nodes.append(ExpressionNode(unit))
+            return len(nodes) - 1
+        values = [self.number_value(nodes[operand]) for operand in operands]
+        if all(value is not None for value in values):
+            with np.errstate(all='ignore'):
+                if len(operands) == 2:
+                    result = unit.action(left=values[0], right=values[1])
+                else:
+                    result = unit.action(right=values[0])
+            self.rewrites.append(('constant folding', unit.start_index))
+            nodes.append(ExpressionNode(GrammarUnit(unit=result, start_index=unit.start_index)))
+            return len(nodes) - 1
+        if unit.unit_type == 'sign' and unit.string_unit == '-':
+            operand = nodes[operands[0]]
+            if operand.unit.unit_type == 'sign' and operand.unit.string_unit == '-':
+                self.rewrites.append(('double sign', unit.start_index))
+                return operand.operands[0]
+        if len(operands) == 2:
+            for side, kept in [('left', operands[1]), ('right', operands[0])]:
+                value = values[0] if side == 'left' else values[1]
+                identity = self.identities.get((unit.string_unit, side))
+                if identity is not None and value == identity:
+                    self.rewrites.append(('identity', unit.start_index))
+                    return kept
+            if unit.string_unit == '^' and values[1] == 2.0:
+                self.rewrites.append(('square', unit.start_index))
+                nodes.append(ExpressionNode(GrammarUnit('*', unit.start_index), (operands[0], operands[0])))
+                return len(nodes) - 1
+        if unit.string_unit in self.fused:
+            self.rewrites.append(('fused ' + unit.string_unit, unit.start_index))
+            nodes.append(ExpressionNode(GrammarUnit(self.fused[unit.string_unit], unit.start_index), operands))
+            return len(nodes) - 1
+        nodes.append(ExpressionNode(unit, operands))
+        return len(nodes) - 1
+
+    def dead_node_remover(self, nodes):
+        root = nodes.pop().operands[0]
+        used = [False] * len(nodes)
+        used[root] = True
+        for i in range(root, -1, -1):
+            if used[i]:
+                for operand in nodes[i].operands:
+                    used[operand] = True
+        positions = dict()
+        kept = list()
+        for i in range(root + 1):
+            if used[i]:
+                positions[i] = len(kept)
+                kept.append(ExpressionNode(nodes[i].unit, tuple(positions[operand] for operand in nodes[i].operands)))
+        return kept
+
+
+class NodeSequenceDifferentiator:
+    # f and f' as one hash-consed node list with the roots [f, f'], derivative nodes reuse the values of f where the rules allow
+    def __init__(self, nodes):
+        self.nodes = list()
+        self.interned = dict()
+        values = [None] * len(nodes)
+        derivatives = [None] * len(nodes) # None is a zero derivative
+        for i, node in enumerate(nodes):
+            operands = tuple(values[operand] for operand in node.operands)
+            values[i] = self.node_interner(node.unit, operands)
+            derivatives[i] = self.derivative_builder(node.unit, values[i], operands, [derivatives[operand] for operand in node.operands])
+        if derivatives[-1] is None:
+            derivatives[-1] = self.number(0.0, nodes[-1].unit.start_index)
+        self.roots = [values[-1], derivatives[-1]]
+        UnitSequenceParser.release_marker(self.nodes)
+
+    def __call__(self, at):
+        return NodeSequenceSolver(self.nodes, at, self.roots).solution
+
+    def number_value(self, i):
+        unit = self.nodes[i].unit
+        return unit.action if unit.unit_type == 'number' else None
+
+    def node_interner(self, unit, operands):
+        values = [self.number_value(operand) for operand in operands]
+        if operands and all(value is not None for value in values):
+            with np.errstate(all='ignore'):
+                if len(operands) == 2:
+                    result = unit.action(left=values[0], right=values[1])
+                else:
+                    result = unit.action(right=values[0])
+            return self.number(result, unit.start_index)
+        if unit.unit_type == 'number':
+            key = ('number', float(unit.action).hex())
+        elif unit.unit_type == 'placeholder':
+            key = ('placeholder',)
+        else:
+            key = (unit.string_unit, unit.unit_type, operands)
+        if key not in self.interned:
+            self.interned[key] = len(self.nodes)
+            self.nodes.append(ExpressionNode(unit, operands))
+        return self.interned[key]
+
+    def number(self, value, start_index):
+        return self.node_interner(GrammarUnit(value, start_index), ())
+
+    def operator(self, operator, unit_type, operands, start_index):
+        unit = GrammarUnit(operator, start_index)
+        unit.unit_type = unit_type
+        return self.node_interner(unit, operands)
+
+    def is_one(self, i):
+        return i is not None and self.number_value(i) == 1.0
+
+    def add(self, a, b, i):
+        if a is None or b is None:
+            return b if a is None else a
+        return self.operator('+', 'addsub', (a, b), i)
+
+    def subtract(self, a, b, i):
+        if b is None:
+            return a
+        if a is None:
+            return self.negative(b, i)
+        return self.operator('-', 'addsub', (a, b), i)
+
+    def negative(self, a, i):
+        return None if a is None else self.operator('-', 'sign', (a,), i)
+
+    def multiply(self, a, b, i):
+        if a is None or b is None:
+            return None
+        if self.is_one(a) or self.is_one(b):
+            return b if self.is_one(a) else a
+        return self.operator('*', 'binary', (a, b), i)
+
+    def divide(self, a, b, i):
+        if a is None:
+            return None
+        return a if self.is_one(b) else self.operator('/', 'binary', (a, b), i)
+
+    def power(self, a, b, i):
+        return a if self.is_one(b) else self.operator('^', 'binary', (a, b), i)
+
+    def derivative_builder(self, unit, value, operands, derivatives):
+        operator, unit_type, i = unit.string_unit, unit.unit_type, unit.start_index
+        if unit_type == 'number':
+            return None
+        if unit_type == 'placeholder':
+            return self.number(1.0, i)
+        if unit_type == 'sign':
+            return derivatives[0] if operator == '+' else self.negative(derivatives[0], i)
+        if unit_type == 'addsub':
+            if operator == '+':
+                return self.add(derivatives[0], derivatives[1], i)
+            return self.subtract(derivatives[0], derivatives[1], i)
+        if all(derivative is None for derivative in derivatives):
+            return None
+        if unit_type == 'binary':
+            (u, w), (du, dw) = operands, derivatives
+            if operator == '*':
+                return self.add(self.multiply(du, w, i), self.multiply(u, dw, i), i)
+            if operator == '/':
+                # (du - (u / w) dw) / w, u / w is the value itself
+                return self.divide(self.subtract(du, self.multiply(value, dw, i), i), w, i)
+            if operator == '%':
+                # u % w = u - w floor(u / w) and floor(u / w) = (u - u % w) / w, the jumps are left out
+                return self.subtract(du, self.multiply(self.divide(self.subtract(u, value, i), w, i), dw, i), i)
+            if operator == '^':
+                if dw is None:
+                    exponent = self.subtract(w, self.number(1.0, i), i)
+                    return self.multiply(self.multiply(w, self.power(u, exponent, i), i), du, i)
+                logarithm = self.multiply(dw, self.operator('log', 'unary', (u,), i), i)
+                if du is None:
+                    return self.multiply(value, logarithm, i)
+                return self.multiply(value, self.add(logarithm, self.divide(self.multiply(w, du, i), u, i), i), i)
+        u, du = operands[0], derivatives[0]
+        if operator == 'sin':
+            return self.multiply(self.operator('cos', 'unary', (u,), i), du, i)
+        if operator == 'cos':
+            return self.negative(self.multiply(self.operator('sin', 'unary', (u,), i), du, i), i)
+        if operator in ['tan', 'tan_fused', 'cot', 'cot_fused']:
+            # 1 + tan^2 and -(1 + cot^2) from the value itself
+            derivative = self.multiply(self.add(self.number(1.0, i), self.multiply(value, value, i), i), du, i)
+            return derivative if operator.startswith('tan') else self.negative(derivative, i)
+        if operator == 'exp':
+            return self.multiply(value, du, i)
+        if operator == 'log':
+            return self.divide(du, u, i)
+        raise ExpressionError(f"No derivative rule for {operator!r} at index {i}.")
+
+
+class NodeSlotAllocator:
+    # operator results get a temporary slot, reused once the value is consumed so large arrays are not kept alive
+    def __init__(self, nodes, roots=()):
+        self.slots, self.slot_count = self.slot_allocator(nodes, set(roots))
+
+    def slot_allocator(self, nodes, roots):
+        # slots of roots are kept until the end
+        slots = [None] * len(nodes)
+        free_slots = list()
+        slot_count = 0
+        for i, node in enumerate(nodes):
+            if not node.operands:
+                continue
+            for operand in node.released:
+                if slots[operand] is not None and operand not in roots:
+                    free_slots.append(slots[operand])
+            if free_slots:
+                slots[i] = free_slots.pop()
+            else:
+                slots[i] = slot_count
+                slot_count += 1
+        return slots, slot_count
+
+
+class NodeSequenceCodeGenerator:
+    # straight-line python source, one assignment per operator node, compiled once
+    def __init__(self, nodes, name='compiled_expression', scalar=False, code=None, roots=None):
+        self.name = name
+        self.scalar = scalar
+        self.roots = roots
+        self.constants = list()
+        if code is None:
+            self.source = self.source_builder(nodes)
+        else:
+            # a stored code object of the function, only its constants are collected again
+            self.source = None
+            self.constants = [node.unit.action for node in nodes if node.unit.unit_type == 'number']
+        self.function = self.function_builder(code)
+
+    @instrumentation.timed('source_builder')
+    def source_builder(self, nodes):
+        slots = NodeSlotAllocator(nodes, self.roots or ()).slots
+        names = [None] * len(nodes)
+        lines = [f"def {self.name}(x):"]
+        for i, node in enumerate(nodes):
+            unit = node.unit
+            if unit.unit_type == 'number':
+                names[i] = f"c{len(self.constants)}"
+                self.constants.append(unit.action)
+                continue
+            if unit.unit_type == 'placeholder':
+                names[i] = 'x'
+                continue
+            spec = Grammar.unit_spec(unit.string_unit)
+            source = spec.get('scalar_source', spec['source']) if self.scalar else spec['source']
+            if Grammar.operator_domain[unit.unit_type] == 'leftright':
+                line = source.format(left=names[node.operands[0]], right=names[node.operands[1]])
+            else:
+                line = source.format(left='0', right=names[node.operands[0]])
+            names[i] = f"t{slots[i]}"
+            lines.append(f"    {names[i]} = {line}")
+        if self.roots is None:
+            lines.append(f"    return {names[-1]}")
+        else:
+            lines.append(f"    return [{', '.join(names[root] for root in self.roots)}]")
+        return '\n'.join(lines) + '\n'
+
+    @instrumentation.timed('function_builder')
+    def function_builder(self, code=None):
+        namespace = {'np' : np}
+        namespace.update((f"c{i}", constant) for i, constant in enumerate(self.constants))
+        if code is not None:
+            return types.FunctionType(code, namespace, self.name)
+        exec(builtins.compile(self.source, f"<{self.name}>", 'exec'), namespace)
+        return namespace[self.name]
+
+
+class ChunkedNodeSequenceSolver:
+    # evaluates chunk by chunk into preallocated slot buffers, the last operator writes straight into the output
+    def __init__(self, nodes):
+        allocator = NodeSlotAllocator(nodes)
+        self.slot_count = allocator.slot_count
+        self.steps, self.result = self.step_planner(nodes, allocator.slots)
+
+    def step_planner(self, nodes, slots):
+        # subtrees without the placeholder are computed once here as scalars, like the other solvers do
+        references = [None] * len(nodes)
+        steps = list()
+        for i, node in enumerate(nodes):
+            unit = node.unit
+            if unit.unit_type == 'number':
+                references[i] = ('number', unit.action)
+                continue
+            if unit.unit_type == 'placeholder':
+                references[i] = ('placeholder', None)
+                continue
+            operands = [references[operand] for operand in node.operands]
+            if len(operands) == 1:
+                operands.insert(0, ('number', 0) if unit.unit_type == 'sign' else None)
+            left, right = operands
+            if right[0] == 'number' and (left is None or left[0] == 'number'):
+                with np.errstate(all='ignore'):
+                    if left is None:
+                        references[i] = ('number', unit.action(right=right[1]))
+                    else:
+                        references[i] = ('number', unit.action(left=left[1], right=right[1]))
+                continue
+            references[i] = ('slot', slots[i])
+            steps.append((unit.action, left, right, slots[i]))
+        return steps, references[-1]
+
+    def __call__(self, at, out, chunk_size):
+        timing = instrumentation.enabled
+        if timing: timing_start = time.perf_counter()
+        buffers = [np.empty(chunk_size) for _ in range(self.slot_count)]
+        last_step = len(self.steps) - 1
+        for start in range(0, at.shape[0], chunk_size):
+            stop = min(start + chunk_size, at.shape[0])
+            chunk = at[start:stop]
+            slot_values = [buffer[:stop - start] for buffer in buffers]
+            for n, (action, left, right, slot) in enumerate(self.steps):
+                # the last step always produces the result, it is the root node
+                target = out[start:stop] if n == last_step else slot_values[slot]
+                if left is None:
+                    action(right=self.operand_value(right, chunk, slot_values), out=target)
+                else:
+                    action(left=self.operand_value(left, chunk, slot_values), right=self.operand_value(right, chunk, slot_values), out=target)
+            if not self.steps:
+                out[start:stop] = self.operand_value(self.result, chunk, slot_values)
+        if timing: instrumentation.record('chunked_solver', time.perf_counter() - timing_start)
+        return out
+
+    def operand_value(self, reference, chunk, slot_values):
+        kind, value = reference
+        if kind == 'slot':
+            return slot_values[value]
+        if kind == 'placeholder':
+            return chunk
+        return value
+
+
+class CompiledExpression:
+    __slots__ = ('expression', 'node_array', 'backend', 'function', 'scalar_function', 'chunked_solver', 'derivative', 'rewrites')
+
+    backends = ['codegen', 'interpreter']
+
+    def __init__(self, expression, backend='codegen', node_table=None, optimize=False, rewrites=(), function_codes=(None, None)):
+        if backend not in self.backends:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {self.backends}.")
+        if node_table is None:
+            unit_sequence = ExpressionUnitizer(expression).unit_sequence
+            nodes = tuple(UnitSequenceParser(unit_sequence, expression).nodes)
+        else:
+            nodes = self.node_loader(node_table)
+        if optimize:
+            optimizer = NodeSequenceOptimizer(nodes)
+            nodes = tuple(optimizer.nodes)
+            rewrites = tuple(rewrites) + tuple(optimizer.rewrites)
+        object.__setattr__(self, 'expression', expression)
+        object.__setattr__(self, 'rewrites', tuple(rewrites))
+        # only the compact node array is kept, the node objects are released after compiling
+        object.__setattr__(self, 'node_array', NodeArray(nodes))
+        object.__setattr__(self, 'backend', backend)
+        if backend == 'codegen':
+            object.__setattr__(self, 'function', NodeSequenceCodeGenerator(nodes, code=function_codes[0]).function)
+            object.__setattr__(self, 'scalar_function', NodeSequenceCodeGenerator(nodes, 'compiled_scalar_expression', True, function_codes[1]).function)
+        else:
+            object.__setattr__(self, 'function', None)
+            object.__setattr__(self, 'scalar_function', None)
+        object.__setattr__(self, 'chunked_solver', None)
+        object.__setattr__(self, 'derivative', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable.")
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.expression!r}, backend={self.backend!r})"
+
+    def __reduce__(self):
+        # pickled as the node table, unpickling does not tokenize or parse the expression again
+        return (type(self), (self.expression, self.backend, self.node_table(), False, self.rewrites))
+
+    @property
+    def nodes(self):
+        return self.node_array.node_sequence()
+
+    def node_table(self):
+        return self.node_array.node_table()
+
+    def node_loader(self, node_table):
+        nodes = list()
+        for unit, start_index, unit_type, operands in node_table:
+            grammar_unit = GrammarUnit(unit, start_index)
+            grammar_unit.unit_type = unit_type
+            nodes.append(ExpressionNode(grammar_unit, tuple(operands)))
+        UnitSequenceParser.release_marker(nodes)
+        return tuple(nodes)
+
+    def __call__(self, at: Union[float, List[float]]) -> List[float]:
+        if (isinstance(at, (int, np.integer)) and not isinstance(at, bool)) or \
+           (isinstance(at, np.ndarray) and at.ndim == 0 and at.dtype.kind in 'iuf'):
+            # ints and 0-d arrays are scalars too, numpy gives a float64 for them as well
+            at = float(at)
+        # generated functions cannot time their actions, with instrumentation enabled the node array evaluates
+        timing = instrumentation.enabled
+        if isinstance(at, float):
+            try:
+                if self.scalar_function is not None and not timing:
+                    return np.float64(self.scalar_function(at))
+                return np.float64(self.node_array(at, NodeArray.unit_scalar_actions))
+            except ZeroDivisionError:
+                # numpy gives inf or nan here, the array path below does the same for a scalar
+                pass
+        if self.function is not None and not timing:
+            return self.function(at)
+        return self.node_array(at)
+
+    def output_allocator(self, at, out):
+        if out is None:
+            return np.empty(at.shape)
+        if out.shape != at.shape or out.dtype != np.float64 or not out.flags.c_contiguous or not out.flags.writeable:
+            raise ValueError("out must be a writeable, C-contiguous float64 array with the shape of at.")
+        return out
+
+    def batch(self, at, out=None, chunk_size=1 << 14):
+        at = np.asarray(at, dtype=np.float64)
+        out = self.output_allocator(at, out)
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive.")
+        self.chunked_solver_getter()(at.reshape(-1), out.reshape(-1), chunk_size)
+        return out
+
+    def grad(self, at):
+        # f and f' in one pass, both with the shape of at
+        values = self.derivative_getter()(at)
+        shape = np.shape(at)
+        results = list()
+        for value in values:
+            if shape == ():
+                value = np.float64(value)
+            elif np.shape(value) != shape:
+                value = np.full(shape, value, dtype=np.float64)
+            elif value is at or any(value is result for result in results) or not isinstance(value, np.ndarray):
+                # f and f' can be one interned node, and f of x is the caller's at
+                value = np.array(value, dtype=np.float64)
+            results.append(value)
+        return tuple(results)
+
+    def derivative_getter(self):
+        if self.derivative is None:
+            differentiator = NodeSequenceDifferentiator(self.nodes)
+            if self.backend == 'codegen':
+                derivative = NodeSequenceCodeGenerator(differentiator.nodes, 'compiled_derivative', roots=differentiator.roots).function
+            else:
+                derivative = differentiator
+            object.__setattr__(self, 'derivative', derivative)
+        return self.derivative
+
+    def chunked_solver_getter(self):
+        # planned on first use, folding constants into the plan needs numpy
+        if self.chunked_solver is None:
+            object.__setattr__(self, 'chunked_solver', ChunkedNodeSequenceSolver(self.node_array.node_sequence()))
+        return self.chunked_solver
+
+
+class ExpressionGraph:
+    # several expressions hash-consed into one node list, identical subtrees are evaluated once
+    def __init__(self, compiled_expressions):
+        self.expressions = [compiled.expression for compiled in compiled_expressions]
+        self.nodes, self.roots = self.node_interner(compiled_expressions)
+        UnitSequenceParser.release_marker(self.nodes)
+
+    def node_key(self, unit, operands):
+        if unit.unit_type == 'number':
+            return ('number', float(unit.action).hex())
+        if unit.unit_type == 'placeholder':
+            return ('placeholder',)
+        return (unit.string_unit, unit.unit_type, operands)
+
+    def node_interner(self, compiled_expressions):
+        nodes = list()
+        roots = list()
+        interned = dict()
+        for compiled in compiled_expressions:
+            compiled_nodes = compiled.nodes
+            positions = [None] * len(compiled_nodes)
+            for i, node in enumerate(compiled_nodes):
+                operands = tuple(positions[operand] for operand in node.operands)
+                key = self.node_key(node.unit, operands)
+                if key not in interned:
+                    interned[key] = len(nodes)
+                    nodes.append(ExpressionNode(node.unit, operands))
+                positions[i] = interned[key]
+            roots.append(positions[-1])
+        return nodes, roots
+
+    def __call__(self, at, stack=False):
+        solutions = NodeSequenceSolver(self.nodes, at, self.roots).solution
+        if stack:
+            shape = np.shape(at)
+            return np.stack([np.broadcast_to(np.asarray(solution, dtype=np.float64), shape) for solution in solutions])
+        return solutions
+
+
+class SharedArray:
+    # float64 array in multiprocessing shared memory, pool workers attach to it by name and share the creator's resource tracker
+    def __init__(self, shape, name=None):
+        self.shape = tuple(shape) if isinstance(shape, (tuple, list)) else (shape,)
+        nbytes = max(int(np.prod(self.shape)) * 8, 1)
+        self.memory = shared_memory.SharedMemory(name=name, create=name is None, size=nbytes if name is None else 0)
+        self.array = np.ndarray(self.shape, dtype=np.float64, buffer=self.memory.buf)
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    def close(self):
+        self.array = None
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        self.unlink()
+
+
+# chunked solvers planned by this worker process, tasks get the node array and not the compiled expression,
+# unpickling that would generate and compile functions the worker never calls
+worker_solvers = OrderedDict()
+worker_solvers_maxsize = 64
+
+
+def worker_solver_getter(node_array):
+    key = node_array.fingerprint()
+    solver = worker_solvers.get(key)
+    if solver is None:
+        solver = worker_solvers[key] = ChunkedNodeSequenceSolver(node_array.node_sequence())
+        while len(worker_solvers) > worker_solvers_maxsize:
+            worker_solvers.popitem(last=False)
+    else:
+        worker_solvers.move_to_end(key)
+    return solver
+
+
+def shared_range_worker(node_array, at_name, out_name, size, start, stop, chunk_size):
+    at = SharedArray((size,), at_name)
+    out = SharedArray((size,), out_name)
+    try:
+        worker_solver_getter(node_array)(at.array[start:stop], out.array[start:stop], chunk_size)
+    finally:
+        at.close()
+        out.close()
+
+
+class ParallelEvaluator:
+    executors = ['process', 'thread']
+
+    def __init__(self, workers=None, executor='process', min_size=1 << 20, chunk_size=1 << 14):
+        if executor not in self.executors:
+            raise ValueError(f"Unknown executor {executor!r}, expected one of {self.executors}.")
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = executor
+        self.min_size = min_size
+        self.chunk_size = chunk_size
+        self.pool = None
+        self.lock = threading.Lock()
+
+    def pool_getter(self):
+        with self.lock:
+            if self.pool is None:
+                pool_class = ProcessPoolExecutor if self.executor == 'process' else ThreadPoolExecutor
+                self.pool = pool_class(max_workers=self.workers)
+            return self.pool
+
+    def shutdown(self):
+        with self.lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def range_splitter(self, size):
+        bounds = np.linspace(0, size, self.workers + 1).astype(int)
+        return [(start, stop) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    def __call__(self, compiled, at, out=None):
+        shared_at = at if isinstance(at, SharedArray) else None
+        shared_out = out if isinstance(out, SharedArray) else None
+        at = shared_at.array if shared_at else np.asarray(at, dtype=np.float64)
+        out = compiled.output_allocator(at, shared_out.array if shared_out else out)
+        # small inputs do not pay for the pool
+        if at.size < self.min_size or self.workers == 1:
+            return compiled.batch(at, out, self.chunk_size)
+        pool = self.pool_getter()
+        ranges = self.range_splitter(at.size)
+        if self.executor == 'thread':
+            # ufunc loops release the GIL, threads share the arrays directly
+            flat_at, flat_out = at.reshape(-1), out.reshape(-1)
+            self.futures_waiter([pool.submit(compiled.chunked_solver_getter(), flat_at[start:stop], flat_out[start:stop], self.chunk_size)
+                                 for start, stop in ranges])
+            return out
+        # the input is copied into shared memory once unless the caller already placed it there
+        at_memory = shared_at or SharedArray(at.shape)
+        out_memory = shared_out or SharedArray(at.shape)
+        try:
+            if not shared_at:
+                at_memory.array[...] = at
+            self.futures_waiter([pool.submit(shared_range_worker, compiled.node_array, at_memory.name, out_memory.name, at.size, start, stop, self.chunk_size)
+                                 for start, stop in ranges])
+            if not shared_out:
+                out[...] = out_memory.array
+        finally:
+            for memory in [at_memory, out_memory]:
+                if memory is not shared_at and memory is not shared_out:
+                    memory.close()
+                    memory.unlink()
+        return out
+
+    def futures_waiter(self, futures):
+        for future in futures:
+            future.result()
+
+
+default_parallel_evaluator = None
+default_parallel_evaluator_lock = threading.Lock()
+
+
+def parallel_evaluator_getter():
+    global default_parallel_evaluator
+    with default_parallel_evaluator_lock:
+        if default_parallel_evaluator is None:
+            default_parallel_evaluator = ParallelEvaluator()
+        return default_parallel_evaluator
+
+
+def compile(expression: str, backend: str = 'codegen', optimize: bool = False, derivative: bool = False) -> CompiledExpression:
+    compiled = CompiledExpression(expression, backend, optimize=optimize)
+    if derivative:
+        compiled.derivative_getter()
+    return compiled
+
+
+class ExpressionStore:
+    # compiled expressions saved as their node arrays and the marshalled code of their generated functions, little-endian:
+    #   header: magic, version, optimize flag, grammar signature length, entry count, python bytecode magic, grammar signature
+    #   index: per entry expression length, node count, constant count, data offset, code lengths, data crc32, expression
+    #   data: per entry constants float64, operands int32, start indices int32, unit codes uint8, function codes
+    # the index is read on the first lookup and node data of an entry when it is first used, from a memory map.
+    # a file of another version, grammar or optimize setting is ignored, code of another python version is not used.
+    # code is loaded like a pickle would be, only open files written by a trusted process. optimizer rewrites are not stored.
+    # a truncated or damaged entry fails its length or crc check before its code is loaded and is compiled again
+    magic = b'EXPRNODE'
+    version = 2
+    header = struct.Struct('<8sHHII4s')
+    entry = struct.Struct('<IIIQIII')
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.optimize = None
+        self.load_code = False
+        self.buffer = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def grammar_signature(cls):
+        return '|'.join(f"{unit}:{unit_type}" for unit, unit_type in NodeArray.unit_keys).encode()
+
+    def index_reader(self):
+        self.entries = dict()
+        if not os.path.exists(self.path) or os.path.getsize(self.path) < self.header.size:
+            return
+        with open(self.path, 'rb') as file:
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, optimize, signature_size, count, code_magic = self.header.unpack_from(self.buffer, 0)
+        position = self.header.size
+        if (magic != self.magic or version != self.version or
+                self.buffer[position:position + signature_size] != self.grammar_signature()):
+            return
+        self.optimize = bool(optimize)
+        self.load_code = code_magic == importlib.util.MAGIC_NUMBER
+        position += signature_size
+        try:
+            for _ in range(count):
+                expression_size, node_count, constant_count, offset, function_size, scalar_size, checksum = self.entry.unpack_from(self.buffer, position)
+                position += self.entry.size
+                expression = self.buffer[position:position + expression_size].decode()
+                position += expression_size
+                self.entries[expression] = (node_count, constant_count, offset, function_size, scalar_size, checksum)
+        except (struct.error, ValueError):
+            # a truncated index keeps the entries read before the damage
+            pass
+
+    def close(self):
+        # the memory map is opened again by the next lookup
+        with self.lock:
+            if self.buffer is not None:
+                self.buffer.close()
+            self.buffer = None
+            self.entries = None
+
+    def array_reader(self, typecode, offset, count):
+        values = array(typecode)
+        data = self.buffer[offset:offset + count * values.itemsize]
+        if len(data) != count * values.itemsize:
+            raise EOFError('stored entry is truncated')
+        values.frombytes(data)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values, offset + count * values.itemsize
+
+    def get(self, expression, optimize=False):
+        # the node table and function codes of an expression, None when it is not stored
+        with self.lock:
+            if self.entries is None:
+                self.index_reader()
+            entries = self.entries
+        if self.optimize != optimize or expression not in entries:
+            return None
+        node_count, constant_count, offset, function_size, scalar_size, checksum = entries[expression]
+        try:
+            size = 8 * constant_count + 13 * node_count + function_size + scalar_size
+            data = self.buffer[offset:offset + size]
+            if len(data) != size or zlib.crc32(data) != checksum:
+                return None
+            constants, offset = self.array_reader('d', offset, constant_count)
+            operands, offset = self.array_reader('i', offset, 2 * node_count)
+            start_indices, offset = self.array_reader('i', offset, node_count)
+            codes, offset = self.array_reader('B', offset, node_count)
+            function_codes = (None, None)
+            if self.load_code and function_size and scalar_size:
+                function_codes = (marshal.loads(self.buffer[offset:offset + function_size]),
+                                  marshal.loads(self.buffer[offset + function_size:offset + function_size + scalar_size]))
+            node_array = NodeArray(())
+            node_array.codes, node_array.operands, node_array.start_indices, node_array.constants = codes, operands, start_indices, list(constants)
+            return node_array.node_table(), function_codes
+        except (EOFError, ValueError, struct.error, IndexError, TypeError):
+            # a truncated or corrupt entry is compiled again, like a missing one. a closed store is a ValueError
+            return None
+
+    @classmethod
+    def save(cls, path, compiled_expressions, optimize=False, keys=None):
+        # entries are looked up by key, the expression itself by default
+        signature = cls.grammar_signature()
+        keys = keys or [compiled.expression for compiled in compiled_expressions]
+        expressions = [key.encode() for key in keys]
+        index_size = cls.header.size + len(signature) + sum(cls.entry.size + len(expression) for expression in expressions)
+        # entries start on 8 byte boundaries, the float64 constants come first
+        offset = index_size + (-index_size % 8)
+        index = [cls.header.pack(cls.magic, cls.version, int(optimize), len(signature), len(expressions), importlib.util.MAGIC_NUMBER), signature]
+        data = [bytes(-index_size % 8)]
+        for compiled, expression in zip(compiled_expressions, expressions):
+            node_array = compiled.node_array
+            function_codes = [marshal.dumps(function.__code__) if function is not None else b''
+                              for function in [compiled.function, compiled.scalar_function]]
+            entry_data = list()
+            for values in [array('d', node_array.constants), node_array.operands, node_array.start_indices, node_array.codes]:
+                if sys.byteorder != 'little':
+                    values = array(values.typecode, values)
+                    values.byteswap()
+                entry_data.append(values.tobytes())
+            entry_data = b''.join(entry_data + function_codes)
+            index.append(cls.entry.pack(len(expression), len(node_array), len(node_array.constants), offset,
+                                        len(function_codes[0]), len(function_codes[1]), zlib.crc32(entry_data)) + expression)
+            data.append(entry_data)
+            offset += len(entry_data)
+            data.append(bytes(-offset % 8))
+            offset += len(data[-1])
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as file:
+            file.write(b''.join(index))
+            file.write(b''.join(data))
+        # replaced in one step, processes still reading the old file keep their memory map
+        os.replace(temporary_path, path)
+
+
+class ExpressionCache:
+    def __init__(self, maxsize=256, optimize=False, store=None):
+        self.maxsize = maxsize
+        self.optimize = optimize
+        self.store = store
+        self.compiled = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def normalize(self, expression):
+        # runs of whitespace become one space, units stay separated
+        return ' '.join(expression.split())
+
+    def cached(self, expression):
+        # the compiled expression when it is cached, None instead of compiling on a miss, which is not counted
+        key = self.normalize(expression)
+        with self.lock:
+            compiled = self.compiled.get(key)
+            if compiled is not None:
+                self.compiled.move_to_end(key)
+                self.hits += 1
+            return compiled
+
+    def get(self, expression):
+        key = self.normalize(expression)
+        with self.lock:
+            compiled = self.compiled.get(key)
+            if compiled is not None:
+                self.compiled.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        # compiling outside the lock, a concurrent miss on the same key only costs a second compile
+        stored = self.store.get(key, self.optimize) if self.store is not None else None
+        if stored is not None:
+            compiled = CompiledExpression(expression, node_table=stored[0], function_codes=stored[1])
+        else:
+            compiled = compile(expression, optimize=self.optimize)
+        with self.lock:
+            self.compiled[key] = compiled
+            self.compiled.move_to_end(key)
+            self.evict()
+        return compiled
+
+    def save(self, path):
+        with self.lock:
+            keys, compiled_expressions = list(self.compiled.keys()), list(self.compiled.values())
+        ExpressionStore.save(path, compiled_expressions, self.optimize, keys)
+
+    def evict(self):
+        while len(self.compiled) > max(self.maxsize, 0):
+            self.compiled.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize):
+        with self.lock:
+            self.maxsize = maxsize
+            self.evict()
+
+    def clear(self):
+        with self.lock:
+            self.compiled.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self):
+        with self.lock:
+            return {'hits' : self.hits,
+                    'misses' : self.misses,
+                    'evictions' : self.evictions,
+                    'size' : len(self.compiled),
+                    'maxsize' : self.maxsize}
+
+
+expression_cache = ExpressionCache()
+
+
 def evaluate(expression: str, at: Union[float, List[float]]) -> List[float]:   
-    expression_parser = ExpressionUnitizer(expression)
-    unit_sequence_solver = UnitSequenceSolver(expression_parser.unit_sequence, at)
-    return unit_sequence_solver.solution
+    return expression_cache.get(expression)(at)
+
+
+def evaluate_batch(expression: str, at: Union[np.ndarray, memoryview], out: np.ndarray = None, chunk_size: int = 1 << 14) -> np.ndarray:
+    return expression_cache.get(expression).batch(at, out, chunk_size)
+
+
+def compile_many(expressions: List[str]) -> ExpressionGraph:
+    return ExpressionGraph([expression_cache.get(expression) for expression in expressions])
+
+
+def evaluate_many(expressions: List[str], at: Union[float, List[float]], stack: bool = False) -> Union[List[np.ndarray], np.ndarray]:
+    return compile_many(expressions)(at, stack)
+
+
+def evaluate_parallel(expression: str, at: Union[np.ndarray, SharedArray], out: Union[np.ndarray, SharedArray] = None, evaluator: ParallelEvaluator = None) -> np.ndarray:
+    evaluator = evaluator or parallel_evaluator_getter()
+    return evaluator(expression_cache.get(expression), at, out)
+
+
+class AsyncEvaluator:
+    # requests for the same expression within the window are evaluated once over the concatenated x values in an executor.
+    # expressions missing from the cache are compiled in the executor too, the event loop only looks them up.
+    # a request of at most inline_size x values with no batch pending is evaluated on the loop, sooner than an executor hop
+    def __init__(self, window=0.001, max_size=1 << 20, executor=None, cache=None, inline_size=16):
+        self.window = window
+        self.max_size = max_size
+        self.executor = executor
+        self.cache = cache or expression_cache
+        self.inline_size = inline_size
+        self.pending = dict()
+        self.compiling = dict()
+        self.tasks = set()
+
+    async def __call__(self, expression, at):
+        loop = asyncio.get_running_loop()
+        key = (loop, self.cache.normalize(expression))
+        compiled = self.cache.cached(expression)
+        if compiled is None:
+            # concurrent misses on one expression wait for the same compile
+            compiling = self.compiling.get(key)
+            if compiling is None:
+                compiling = self.compiling[key] = loop.run_in_executor(self.executor, self.cache.get, expression)
+                compiling.add_done_callback(lambda future : self.compiling.pop(key, None))
+            # shielded, a cancelled caller would otherwise cancel the compile for the others
+            compiled = await asyncio.shield(compiling)
+        at = np.asarray(at, dtype=np.float64)
+        batch = self.pending.get(key)
+        if batch is None and at.size <= self.inline_size:
+            return compiled(at)
+        if batch is None:
+            batch = self.pending[key] = {'compiled' : compiled, 'requests' : list(), 'size' : 0}
+            loop.call_later(self.window, self.flush, key, batch)
+        future = loop.create_future()
+        batch['requests'].append((at, future))
+        batch['size'] += at.size
+        if batch['size'] >= self.max_size:
+            self.flush(key, batch)
+        return await future
+
+    def flush(self, key, batch):
+        # the window timer of a batch flushed early by max_size finds it gone
+        if self.pending.get(key) is not batch:
+            return
+        del self.pending[key]
+        task = asyncio.ensure_future(self.batch_runner(batch['compiled'], batch['requests']))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def batch_runner(self, compiled, requests):
+        loop = asyncio.get_running_loop()
+        if len(requests) == 1:
+            at = requests[0][0]
+        else:
+            at = np.concatenate([request_at.reshape(-1) for request_at, future in requests])
+        try:
+            result = await loop.run_in_executor(self.executor, compiled, at)
+        except Exception as e:
+            for request_at, future in requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        if len(requests) == 1:
+            if not requests[0][1].done():
+                requests[0][1].set_result(result)
+            return
+        if np.shape(result) != at.shape:
+            # expressions without the placeholder evaluate to a scalar
+            result = np.full(at.shape, result)
+        start = 0
+        for request_at, future in requests:
+            stop = start + request_at.size
+            if not future.done():
+                future.set_result(result[start:stop].reshape(request_at.shape)[()])
+            start = stop
+
+
+default_async_evaluator = None
+default_async_evaluator_lock = threading.Lock()
+
+
+def async_evaluator_getter():
+    global default_async_evaluator
+    with default_async_evaluator_lock:
+        if default_async_evaluator is None:
+            default_async_evaluator = AsyncEvaluator()
+        return default_async_evaluator
+
+
+async def aevaluate(expression: str, at: Union[float, List[float]]) -> List[float]:
+    return await async_evaluator_getter()(expression, at)
+
+
+class StreamEvaluator:
+    # x values are read, evaluated and written chunk by chunk, memory use does not depend on the input size
+    def __init__(self, compiled, chunk_size=1 << 16):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive.")
+        self.compiled = compiled
+        self.chunk_size = chunk_size
+        self.out = np.empty(chunk_size)
+
+    def text_chunk_reader(self, stream):
+        remainder = ''
+        values = list()
+        size = 0
+        while True:
+            block = stream.read(1 << 20)
+            text = remainder + block
+            if block:
+                # a number may continue in the next block
+                cut = max(text.rfind(separator) for separator in ', \t\n\r')
+                text, remainder = text[:cut + 1], text[cut + 1:]
+            numbers = np.array(text.replace(',', ' ').split(), dtype=np.float64)
+            values.append(numbers)
+            size += numbers.size
+            while size >= self.chunk_size or (not block and size):
+                joined = np.concatenate(values)
+                yield joined[:self.chunk_size]
+                values = [joined[self.chunk_size:]]
+                size = values[0].size
+            if not block:
+                return
+
+    def binary_chunk_reader(self, path):
+        if path == '-':
+            yield from self.binary_stream_reader(sys.stdin.buffer)
+            return
+        if os.path.getsize(path) % 8:
+            raise ValueError(f"{path} is not a whole number of float64 values.")
+        if os.path.getsize(path) == 0:
+            return
+        at = np.memmap(path, dtype=np.float64, mode='r')
+        for start in range(0, at.size, self.chunk_size):
+            yield at[start:start + self.chunk_size]
+
+    def binary_stream_reader(self, stream):
+        buffer = bytearray(self.chunk_size * 8)
+        view = memoryview(buffer)
+        while True:
+            filled = 0
+            while filled < len(buffer):
+                read = stream.readinto(view[filled:])
+                if not read:
+                    break
+                filled += read
+            if filled % 8:
+                raise ValueError("Binary input is not a whole number of float64 values.")
+            if filled:
+                yield np.frombuffer(buffer, dtype=np.float64, count=filled // 8)
+            if filled < len(buffer):
+                return
+
+    def __call__(self, input_path, input_format='text', output_path='-', output_format='text'):
+        if input_format == 'text':
+            input_stream = sys.stdin if input_path == '-' else open(input_path, 'r')
+            chunks = self.text_chunk_reader(input_stream)
+        else:
+            input_stream = None
+            chunks = self.binary_chunk_reader(input_path)
+        binary = output_format == 'binary'
+        if output_path == '-':
+            output_stream = sys.stdout.buffer if binary else sys.stdout
+        else:
+            output_stream = open(output_path, 'wb' if binary else 'w')
+        try:
+            for chunk in chunks:
+                result = self.compiled.batch(chunk, self.out[:chunk.size], self.chunk_size)
+                if binary:
+                    output_stream.write(result.tobytes())
+                else:
+                    np.savetxt(output_stream, result, fmt='%.17g')
+            output_stream.flush()
+        finally:
+            if input_stream is not None and input_stream is not sys.stdin:
+                input_stream.close()
+            if output_path != '-':
+                output_stream.close()
 
 
-if __name__ == "__main__": 
-    # cli = CliInputTransformer()
-    # result = evaluate(cli.inputs.expression, cli.inputs.numbers)
-    result = evaluate('-1*(sin(25.6%x)+4/((-3.09*x)-(cos(2)-4)))', [5, 8])
-    print(result)
\ No newline at end of file
+if __name__ == "__main__":
+    cli = CliInputTransformer()
+    if cli.inputs.numbers is not None:
+        result = evaluate(cli.inputs.expression, cli.inputs.numbers)
+        print(result)
+    else:
+        stream_evaluator = StreamEvaluator(expression_cache.get(cli.inputs.expression), cli.inputs.chunk_size)
+        stream_evaluator(cli.inputs.input, cli.inputs.input_format, cli.inputs.output, cli.inputs.output_format)
\ No newline at end of file
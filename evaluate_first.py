@@ -77,6 +77,8 @@ class Grammar():
         return unit_to_group
 
 class GrammarUnit:
+    __slots__ = ('str_unit', 'str_index', 'unit_type', 'action')
+
     def __init__(self, str_unit, str_index, unit_type, action=None):
         self.str_unit = str_unit
         self.str_index = str_index
@@ -202,28 +204,28 @@ class ExpressionParser:
             if entity.unit_type == 'sign':
                 result = entity.action(block_sequence[i+1].action)
                 block_sequence[i] = None
-                block_sequence[i+1] = GrammarUnit(str_unit=str(result), str_index=None, unit_type='number', action=result)
+                block_sequence[i+1] = GrammarUnit(str_unit=None, str_index=None, unit_type='number', action=result)
         block_sequence = list(filter(lambda x: x is not None, block_sequence))                
 
         for i, entity in enumerate(block_sequence):
             if entity.unit_type == 'unary':
                 result = entity.action(block_sequence[i+1].action)
                 block_sequence[i] = None
-                block_sequence[i+1] = GrammarUnit(str_unit=str(result), str_index=None, unit_type='number', action=result)
+                block_sequence[i+1] = GrammarUnit(str_unit=None, str_index=None, unit_type='number', action=result)
         block_sequence = list(filter(lambda x: x is not None, block_sequence))
 
         for i, entity in enumerate(block_sequence):
             if entity.unit_type == 'binary':
                 result = entity.action(block_sequence[i-1].action, block_sequence[i+1].action)
                 block_sequence[i], block_sequence[i-1] = None, None
-                block_sequence[i+1] = GrammarUnit(str_unit=str(result), str_index=None, unit_type='number', action=result)
+                block_sequence[i+1] = GrammarUnit(str_unit=None, str_index=None, unit_type='number', action=result)
         block_sequence = list(filter(lambda x: x is not None, block_sequence))
 
         for i, entity in enumerate(block_sequence):
             if entity.unit_type == 'addsub':
                 result = entity.action(block_sequence[i-1].action, block_sequence[i+1].action)
                 block_sequence[i], block_sequence[i-1] = None, None
-                block_sequence[i+1] = GrammarUnit(str_unit=str(result), str_index=None, unit_type='number', action=result)
+                block_sequence[i+1] = GrammarUnit(str_unit=None, str_index=None, unit_type='number', action=result)
         block_sequence = list(filter(lambda x: x is not None, block_sequence))
 
         if len(block_sequence) > 1:
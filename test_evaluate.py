@@ -0,0 +1,161 @@
+import asyncio
+import random
+import time
+import warnings
+
+import numpy as np
+import pytest
+
+import evaluate
+
+
+class RandomExpressions:
+    # signs, constants, identities and squares in every position, so each optimizer rewrite is reached
+    binary = ['+', '-', '*', '/', '^']
+    unary = ['sin', 'cos', 'tan', 'cot', 'exp']
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+
+    def operand(self):
+        return self.random.choice(['x', 'x', '0', '1', '2', str(self.random.randint(3, 9)), f"{self.random.uniform(0.5, 9.5):.2f}"])
+
+    def term(self, depth):
+        if depth == 0:
+            return self.operand()
+        choice = self.random.random()
+        if choice < 0.25:
+            return f"({self.random.choice(['+', '-'])}({self.term(depth - 1)}))"
+        if choice < 0.45:
+            return f"{self.random.choice(self.unary)}({self.term(depth - 1)})"
+        return f"({self.term(depth - 1)}{self.random.choice(self.binary)}{self.term(depth - 1)})"
+
+    def expression(self):
+        return self.term(self.random.randint(1, 4))
+
+
+def assert_same(result, expected, message):
+    # the fused tan and cot differ from sin / cos in the last bits, a sign error is far outside the tolerance
+    assert np.allclose(result, expected, rtol=1e-9, atol=1e-12, equal_nan=True), message
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_optimized_results_equal_unoptimized(seed):
+    expressions = RandomExpressions(seed)
+    at = np.linspace(-2.5, 2.5, 11)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for _ in range(250):
+            expression = expressions.expression()
+            optimized = evaluate.compile(expression, optimize=True)
+            expected = evaluate.compile(expression)(at)
+            assert_same(optimized(at), expected, (expression, optimized.rewrites))
+            assert_same(optimized(at[3]), np.asarray(expected)[3] if np.ndim(expected) else expected, (expression, optimized.rewrites))
+
+
+def test_sign_over_sign():
+    at = np.array([2.0])
+    for expression, expected in [('+(-x)*2', -4.0), ('1+(+(-x))', -1.0), ('-(-x)', 2.0), ('-(+x)', -2.0)]:
+        assert evaluate.compile(expression, optimize=True)(at)[0] == expected, expression
+
+
+def test_cancelled_request_does_not_cancel_shared_compile():
+    class SlowCache(evaluate.ExpressionCache):
+        def get(self, expression):
+            time.sleep(0.1)
+            return super().get(expression)
+
+    async def requests():
+        evaluator = evaluate.AsyncEvaluator(cache=SlowCache())
+        first = asyncio.ensure_future(evaluator('x*3', 2.0))
+        second = asyncio.ensure_future(evaluator('x*3', 2.0))
+        await asyncio.sleep(0.02)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(requests()) == (6.0, True)
+
+
+def test_instrumentation_times_actions_of_compiled_expressions():
+    evaluate.instrumentation.reset()
+    evaluate.instrumentation.enable()
+    try:
+        result = evaluate.evaluate('sin(x)*2+x', [1.0, 2.0])
+    finally:
+        evaluate.instrumentation.disable()
+    stages = evaluate.instrumentation.stats()['stages']
+    evaluate.instrumentation.reset()
+    assert np.allclose(result, np.sin([1.0, 2.0]) * 2 + [1.0, 2.0])
+    assert {'action sin', 'action *', 'action +', 'node_array'} <= set(stages)
+
+
+store_expressions = ['sin(x)*2+x^3', 'x/(x-1)', 'exp(-x)+cos(x*2)', '3+4*x', '(x*1)^2+0/0']
+
+
+def test_store_round_trip(tmp_path):
+    path = str(tmp_path / 'expressions.bin')
+    at = np.linspace(0.1, 2, 5)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        for optimize in [False, True]:
+            evaluate.ExpressionStore.save(path, [evaluate.compile(expression, optimize=optimize) for expression in store_expressions], optimize)
+            store = evaluate.ExpressionStore(path)
+            try:
+                for expression in store_expressions:
+                    stored = store.get(expression, optimize)
+                    assert stored is not None, expression
+                    loaded = evaluate.CompiledExpression(expression, node_table=stored[0], function_codes=stored[1])
+                    expected = evaluate.compile(expression, optimize=optimize)
+                    assert np.array_equal(loaded(at), expected(at), equal_nan=True), expression
+                    assert np.array_equal(loaded(0.5), expected(0.5), equal_nan=True), expression
+            finally:
+                store.close()
+
+
+def test_store_written_with_other_optimize_setting_is_ignored(tmp_path):
+    path = str(tmp_path / 'expressions.bin')
+    evaluate.ExpressionStore.save(path, [evaluate.compile(expression) for expression in store_expressions], optimize=False)
+    store = evaluate.ExpressionStore(path)
+    try:
+        assert store.get(store_expressions[0], optimize=False) is not None
+        assert all(store.get(expression, optimize=True) is None for expression in store_expressions)
+    finally:
+        store.close()
+
+
+def test_store_of_other_version_is_ignored(tmp_path, monkeypatch):
+    path = str(tmp_path / 'expressions.bin')
+    evaluate.ExpressionStore.save(path, [evaluate.compile(expression) for expression in store_expressions])
+    monkeypatch.setattr(evaluate.ExpressionStore, 'version', evaluate.ExpressionStore.version + 1)
+    store = evaluate.ExpressionStore(path)
+    try:
+        assert all(store.get(expression) is None for expression in store_expressions)
+    finally:
+        store.close()
+
+
+def test_damaged_store_falls_back_to_compiling(tmp_path):
+    path = str(tmp_path / 'expressions.bin')
+    evaluate.ExpressionStore.save(path, [evaluate.compile(expression) for expression in store_expressions])
+    with open(path, 'rb') as file:
+        data = file.read()
+    rng = random.Random(0)
+    damaged = [data[:size] for size in range(0, len(data), 11)]
+    for _ in range(300):
+        flipped = bytearray(data)
+        flipped[rng.randrange(len(flipped))] ^= 1 << rng.randrange(8)
+        damaged.append(bytes(flipped))
+    at = np.linspace(0.1, 2, 5)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        expected = {expression : evaluate.compile(expression)(at) for expression in store_expressions}
+        for contents in damaged:
+            with open(path, 'wb') as file:
+                file.write(contents)
+            store = evaluate.ExpressionStore(path)
+            try:
+                cache = evaluate.ExpressionCache(store=store)
+                for expression in store_expressions:
+                    assert np.array_equal(cache.get(expression)(at), expected[expression], equal_nan=True), expression
+            finally:
+                store.close()